@@ -2,10 +2,22 @@
 # scrape.py – NPS Looker-Studio scraper with headless auto-login,
 #             detailed logging, and screenshots on failure.
 
-import os, sys, csv, time, logging, re, requests, configparser, datetime
+import os, sys, csv, time, random, logging, re, requests, orjson, configparser, datetime, hashlib, mmap, threading, queue, atexit, signal, fcntl
 from pathlib import Path
+from urllib.parse import urlsplit
+from email.utils import parsedate_to_datetime
+from logging.handlers import QueueHandler, QueueListener
+from dataclasses import dataclass, field, fields
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 from playwright.sync_api import (
     sync_playwright,
+    Error as PlaywrightError,
     TimeoutError as PlaywrightTimeoutError,
 )
 
@@ -14,46 +26,178 @@ LOG_DIR = Path("logs");   LOG_DIR.mkdir(exist_ok=True)
 SS_DIR  = Path("screens"); SS_DIR.mkdir(exist_ok=True)
 
 log_file = LOG_DIR / f"scrape_{datetime.datetime.now():%Y%m%d_%H%M%S}.log"
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s | %(levelname)-8s | %(message)s",
-    handlers=[logging.FileHandler(log_file, encoding="utf-8"),
-              logging.StreamHandler(sys.stdout)],
-)
+log_fmt  = logging.Formatter("%(asctime)s | %(levelname)-8s | %(message)s")
+log_sinks = [logging.FileHandler(log_file, encoding="utf-8"), logging.StreamHandler(sys.stdout)]
+for h in log_sinks: h.setFormatter(log_fmt)
+# callers only enqueue; file/stdout writes happen on the listener thread
+log_queue = queue.SimpleQueue()
+logging.basicConfig(level=logging.INFO, format="%(message)s", handlers=[QueueHandler(log_queue)])
+log_listener = QueueListener(log_queue, *log_sinks, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger("scraper")
 logging.getLogger("playwright").setLevel(logging.WARNING)
+logging.getLogger("urllib3").setLevel(logging.ERROR)   # retry warnings quote the webhook key/token
 
 # ─────────────────────────────────────────── CONFIG ──
-cfg = configparser.ConfigParser()
-cfg.read("config.ini", encoding="utf-8")
-def opt(k): return os.getenv(k) or cfg["DEFAULT"].get(k, "")
+@dataclass(frozen=True)
+class Cfg:
+    GOOGLE_EMAIL: str
+    GOOGLE_PASSWORD: str = field(repr=False)
+    MAIN_WEBHOOK: str
+    ALERT_WEBHOOK: str
+    LOOKER_ROOT_SELECTOR: str   # optional: CSS selector of the comments widget; "" ⇒ whole page
+
+REQUIRED_KEYS = ("GOOGLE_EMAIL", "GOOGLE_PASSWORD", "MAIN_WEBHOOK")
 
-GOOGLE_EMAIL, GOOGLE_PASSWORD = opt("GOOGLE_EMAIL"), opt("GOOGLE_PASSWORD")
-MAIN_WEBHOOK, ALERT_WEBHOOK   = opt("MAIN_WEBHOOK"), opt("ALERT_WEBHOOK")
-if not (GOOGLE_EMAIL and GOOGLE_PASSWORD and MAIN_WEBHOOK):
+def load_config():
+    """Environment first, config.ini [DEFAULT] second – the INI is only parsed if a
+    required key is missing from env (optional ones may legitimately be unset)."""
+    keys=[f.name for f in fields(Cfg)]
+    ini=configparser.ConfigParser()
+    if not all(os.getenv(k) for k in REQUIRED_KEYS): ini.read("config.ini", encoding="utf-8")
+    return Cfg(**{k: os.getenv(k) or ini["DEFAULT"].get(k, "") for k in keys})
+
+CFG = load_config()
+if not all(getattr(CFG, k) for k in REQUIRED_KEYS):
     logger.critical("Missing GOOGLE_EMAIL, GOOGLE_PASSWORD or MAIN_WEBHOOK.")
     sys.exit(1)
 
 # ───────────────────────────────────────── CONSTANTS ──
 AUTH_STATE_PATH   = "auth_state.json"
 COMMENTS_LOG_PATH = "comments_log.csv"
+SEEN_INDEX_PATH   = "comments_log.idx"      # magic, '<Q' CSV size covered, then sorted '<Q' keys
+SEEN_INDEX_MAGIC  = b"NPSIDX1\0"
+WRITER_LOCK_PATH  = "comments_log.lock"     # flock'd by the one process allowed to append
+PAYLOAD_CACHE_PATH = "payload_cache.bin"    # 8-byte digests of recently posted cards, oldest first
+PAYLOAD_CACHE_SIZE = 1024
 LOOKER_URL        = "https://lookerstudio.google.com/reporting/b69cfd73-8c0a-453d-9c10-6561fa953f7c/page/p_bghtutfsbd"
+BROWSER_WS_PATH   = "browser_endpoint"   # written by scrape_server.py (same dir) while it runs
+PROFILE_DIR       = ".chrome-profile"   # persistent Chromium profile (HTTP cache, service workers)
 
 NAV_TIMEOUT   = 60_000
 SEL_TIMEOUT   = 30_000
 LOGIN_TIMEOUT = 120_000
 TWOFA_TIMEOUT = 180_000
+WAIT_BUDGET   = 20_000   # max wait for the report to settle after the load event
+DATA_QUIET_MS = 1_000    # no report-data RPC in flight for this long ⇒ loaded
+
+DAEMON_INTERVAL = 900   # seconds between scrapes in daemon mode
+
+POST_WORKERS  = 4     # concurrent webhook POSTs
+CHAT_RPM      = 60    # MAIN_WEBHOOK POSTs per minute (Google Chat per-space quota), spaced evenly ⇒ 1 rps
+HTTP_TIMEOUT  = (3, 10)   # (connect, read) seconds for webhook POSTs
+POST_ATTEMPTS = 6         # tries per card; 429/5xx are retried in post_chat
+RETRY_STATUS  = frozenset((429, 500, 502, 503, 504))
+RETRY_BACKOFF = 1.0       # s before the 2nd try, doubling after (plus ≤0.5 s jitter) unless Retry-After says otherwise
+BREAKER_FAILS    = 5      # consecutive 429/5xx/transport failures that open the breaker
+BREAKER_COOLDOWN = 60.0   # seconds the breaker stays open
+
+# one keep-alive pool for every webhook POST in the run; bodies are pre-encoded JSON
+SESSION = requests.Session()
+SESSION.headers["Content-Type"] = "application/json; charset=UTF-8"
+# urllib3 only retries failed connects (nothing was sent). No read/other retries: the POST
+# may already have landed. No status retries: post_chat does those, so each attempt goes
+# through CHAT_LIMIT and CHAT_GATE
+POST_RETRY = Retry(total=5, read=0, status=0, other=0, backoff_factor=1.0, backoff_jitter=0.5,
+                   allowed_methods={"POST"}, raise_on_status=False)
+SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2*POST_WORKERS, max_retries=POST_RETRY))
+
+class RateLimiter:
+    """`per_min` calls a minute, spaced at least 60/per_min s apart across posting threads –
+    so no 60 s window ever holds more than `per_min`. acquire() blocks until the next slot;
+    every attempt (retries included) must take one."""
+    def __init__(self, per_min):
+        self.gap = 60.0/per_min
+        self.next = 0.0   # monotonic time of the earliest next call
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:   # held while sleeping ⇒ waiters are released in order
+            now=time.monotonic()
+            if now<self.next:
+                time.sleep(self.next-now); now=self.next
+            self.next=now+self.gap
+
+class PostGovernor:
+    """AIMD cap on in-flight webhook POSTs with a circuit breaker: the cap halves on
+    429/5xx and regains 0.5 per success (max `cap`); `trip` failures in a row open the
+    breaker and acquire() refuses posts for `cooldown` s. One failure after the
+    cooldown re-opens it, one success closes it."""
+    def __init__(self, cap, trip=BREAKER_FAILS, cooldown=BREAKER_COOLDOWN):
+        self.cap, self.trip, self.cooldown = cap, trip, cooldown
+        self.limit = float(cap)
+        self.inflight = self.fails = 0
+        self.open_until = 0.0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        """Block for a slot; False (no slot taken) while the breaker is open."""
+        with self.cond:
+            while True:
+                if time.monotonic()<self.open_until: return False
+                if self.inflight<int(self.limit):
+                    self.inflight+=1; return True
+                self.cond.wait()
+
+    def release(self, ok):
+        """ok: True on 2xx, False on 429/5xx/transport error, None for anything else."""
+        with self.cond:
+            self.inflight-=1
+            if ok:
+                self.limit=min(self.cap, self.limit+0.5); self.fails=0
+            elif ok is False:
+                self.limit=max(1.0, self.limit/2); self.fails+=1
+                now=time.monotonic()
+                if self.fails>=self.trip and now>=self.open_until:
+                    self.open_until=now+self.cooldown
+                    logger.error(f"{self.fails} webhook failures in a row ⇒ posting paused for {self.cooldown:.0f}s")
+            self.cond.notify_all()
+
+CHAT_LIMIT = RateLimiter(CHAT_RPM)
+CHAT_GATE  = PostGovernor(POST_WORKERS)
 
 # ─────────────────────────────────────────── ALERTS ──
 def send_alert(msg):
-    if not ALERT_WEBHOOK or "chat.googleapis.com" not in ALERT_WEBHOOK:
+    if not CFG.ALERT_WEBHOOK or "chat.googleapis.com" not in CFG.ALERT_WEBHOOK:
         logger.warning("ALERT_WEBHOOK not configured")
         return
     try:
-        requests.post(ALERT_WEBHOOK, json={"text": msg}, timeout=15).raise_for_status()
-        logger.info("Alert sent")
-    except Exception as e:
-        logger.error(f"Alert failed: {e}")
+        r=SESSION.post(CFG.ALERT_WEBHOOK, data=orjson.dumps({"text": msg}), timeout=HTTP_TIMEOUT)
+    except Exception as e:   # requests' message embeds the URL – log the type only
+        logger.error(f"Alert failed: {type(e).__name__}"); return
+    if r.ok: logger.info("Alert sent")
+    else:    logger.error(f"Alert failed: HTTP {r.status_code}")
+
+# ─────────────────────────────────────────── BROWSER ──
+def browser_endpoint():
+    """CDP endpoint advertised by scrape_server.py, or None. That browser is handed the
+    Google password and cookies, so only a file of ours, not writable by others,
+    pointing at loopback is trusted."""
+    f=Path(BROWSER_WS_PATH)
+    try: st=f.stat()
+    except FileNotFoundError: return None
+    endpoint=f.read_text().strip()
+    if st.st_uid!=os.getuid() or st.st_mode&0o022 or urlsplit(endpoint).hostname not in ("127.0.0.1","::1","localhost"):
+        logger.warning(f"Ignoring untrusted {BROWSER_WS_PATH} ⇒ launching")
+        return None
+    return endpoint
+
+def open_context(p):
+    """The one context used for login and scraping, plus its closer. Lives on the warm
+    scrape_server.py Chromium if one is advertised, else on a persistent profile so
+    Looker's HTTP cache survives between runs."""
+    state=AUTH_STATE_PATH if Path(AUTH_STATE_PATH).exists() else None
+    if endpoint:=browser_endpoint():
+        try:
+            browser=p.chromium.connect_over_cdp(endpoint)
+            logger.info(f"Attached to browser server {endpoint}")
+            return browser.new_context(storage_state=state), browser.close
+        except Exception as e:
+            logger.warning(f"Browser server {endpoint} unreachable ({e}) ⇒ launching")
+    ctx=p.chromium.launch_persistent_context(PROFILE_DIR, headless=True)
+    if state: ctx.add_cookies(orjson.loads(Path(state).read_bytes())["cookies"])
+    return ctx, ctx.close
 
 # ───────────────────────────── HEADLESS AUTO-LOGIN ──
 def auto_login_and_save(ctx) -> bool:
@@ -65,12 +209,12 @@ def auto_login_and_save(ctx) -> bool:
 
         # 1) email
         page.wait_for_selector("input[type='email']", timeout=SEL_TIMEOUT)
-        page.fill("input[type='email']", GOOGLE_EMAIL)
+        page.fill("input[type='email']", CFG.GOOGLE_EMAIL)
         page.get_by_role("button", name=re.compile("Next", re.I)).click()
 
         # 2) password
         page.wait_for_selector("input[type='password']", timeout=SEL_TIMEOUT)
-        page.fill("input[type='password']", GOOGLE_PASSWORD)
+        page.fill("input[type='password']", CFG.GOOGLE_PASSWORD)
         page.get_by_role("button", name=re.compile("Next", re.I)).click()
 
         logger.info("Waiting for 2-factor push approval …")
@@ -96,20 +240,80 @@ def auto_login_and_save(ctx) -> bool:
         page.close()
 
 # ──────────────────────────────── SCRAPE PAGE ──
+# Rows are on screen once a store line is followed by a score line (same
+# shapes parse_comments looks for). Both scripts read the text under
+# LOOKER_ROOT_SELECTOR when it matches, else the whole <body>.
+READY_JS = r"""(sel) => {
+  const root = (sel && document.querySelector(sel)) || document.body;
+  const ls = (root ? root.innerText : "").split("\n").map(l => l.trim());
+  const i = ls.findIndex(l => /^\d+\s+/.test(l));
+  return i !== -1 && ls.slice(i + 2).some(l => /^[0-9]{1,2}$/.test(l));
+}"""
+
+# Never needed for inner_text(). Stylesheets stay: innerText honours CSS visibility.
+BLOCKED_RESOURCES = {"image", "font", "media"}
+# Telemetry only – matched as host suffixes, so Looker's own Google hosts pass
+BLOCKED_HOSTS = ("google-analytics.com", "googletagmanager.com", "doubleclick.net",
+                 "googlesyndication.com", "googleadservices.com")
+
+def block_heavy(route):
+    req=route.request
+    host=urlsplit(req.url).hostname or ""
+    if req.resource_type in BLOCKED_RESOURCES or host.endswith(BLOCKED_HOSTS): route.abort()
+    else: route.continue_()
+
+# Page text from the first line that could open a record (any decimal digit –
+# a superset of parse_comments' store test), split like str.splitlines().
+LINES_JS = r"""(sel) => {
+  const root = (sel && document.querySelector(sel)) || document.body;
+  const ls = (root ? root.innerText : "")
+    .split(/\r\n|[\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]/);
+  if (ls.length && ls[ls.length - 1] === "") ls.pop();
+  const i = ls.findIndex(l => /\p{Nd}/u.test(l));
+  return i === -1 ? [] : ls.slice(i);
+}"""
+
+# Looker Studio fetches every widget's rows through this RPC
+DATA_RPC = "batchedDataV2"
+
+def wait_for_report(page, inflight, answered):
+    """Poll until the report has settled – rows rendered, or data RPCs answered and long
+    quiet (empty report) – or we land on the login page, or WAIT_BUDGET runs out."""
+    deadline=time.monotonic()+WAIT_BUDGET/1000; quiet=0
+    while time.monotonic()<deadline:
+        page.wait_for_timeout(250)
+        if "accounts.google.com" in page.url: return
+        quiet=0 if inflight else quiet+250
+        if quiet<DATA_QUIET_MS: continue
+        try: rows=page.evaluate(READY_JS, CFG.LOOKER_ROOT_SELECTOR)
+        except PlaywrightError: rows=False   # navigating (e.g. to login) – re-check next tick
+        if rows or (answered and quiet>=3*DATA_QUIET_MS): return
+    logger.warning(f"Report not settled within {WAIT_BUDGET} ms – reading page as is")
+
 def fetch_page_lines(ctx):
     page = ctx.new_page()
+    page.route("**/*", block_heavy)
+    inflight, answered = set(), []
+    def on_finished(r):
+        if r in inflight: inflight.discard(r); answered.append(r)
+    page.on("request", lambda r: DATA_RPC in r.url and inflight.add(r))
+    page.on("requestfinished", on_finished)
+    page.on("requestfailed", inflight.discard)
     try:
         logger.info("Opening Looker Studio report …")
         page.goto(LOOKER_URL, timeout=NAV_TIMEOUT, wait_until="load")
+        load_ms = page.evaluate("() => Math.round(performance.getEntriesByType('navigation')[0]?.loadEventEnd ?? 0)")
+        logger.info(f"Report load event after {load_ms} ms")
         if "accounts.google.com" in page.url:
             logger.warning("Redirected to login")
             return None
-        page.wait_for_timeout(10_000)
+        wait_for_report(page, inflight, answered)
         if "accounts.google.com" in page.url:
             logger.warning("Redirected to login after wait")
             return None
-        text = page.locator("body").inner_text()
-        return text.splitlines()
+        if CFG.LOOKER_ROOT_SELECTOR and not page.locator(CFG.LOOKER_ROOT_SELECTOR).count():
+            logger.warning(f"LOOKER_ROOT_SELECTOR {CFG.LOOKER_ROOT_SELECTOR!r} not found – reading whole page")
+        return page.evaluate(LINES_JS, CFG.LOOKER_ROOT_SELECTOR)
     except Exception as e:
         ss = SS_DIR / f"scrape_error_{int(time.time())}.png"
         page.screenshot(path=ss)
@@ -119,82 +323,292 @@ def fetch_page_lines(ctx):
         page.close()
 
 # ─────────────────────────────── PARSER / IO ──
-store_re, score_re = re.compile(r"^\d+\s+.*"), re.compile(r"^[0-9]{1,2}$")
+score_tokens = frozenset([f"{d}" for d in range(10)]+[f"{d:02d}" for d in range(100)])   # ≡ ^[0-9]{1,2}$
+EXPECT_STORE, EXPECT_TS, COLLECT = range(3)
 def parse_comments(lines):
-    out=[]; i=0; n=len(lines)
-    while i<n:
-        if store_re.match(lines[i].strip()):
-            store=lines[i].strip(); i+=1
-            ts  = lines[i].strip() if i<n else ""
-            i+=1; body=[]; score=""
-            while i<n and not score_re.match(lines[i].strip()):
-                body.append(lines[i].strip()); i+=1
-            if i<n: score=lines[i].strip(); i+=1
-            out.append({"store":store,"timestamp":ts,
-                        "comment":"\n".join(body),"score":score})
-        else: i+=1
+    """Records are: store line, timestamp line, comment lines…, score line."""
+    out=[]; cur=None; body=[]; state=EXPECT_STORE
+    for s in map(str.strip, lines):
+        if state==EXPECT_STORE:
+            if s[:1].isdecimal() and len(p:=s.split(None,1))==2 and p[0].isdecimal():   # ≡ ^\d+\s+
+                cur={"store":s}; body=[]; state=EXPECT_TS
+        elif state==EXPECT_TS:
+            cur["timestamp"]=s; state=COLLECT
+        elif s in score_tokens:
+            cur["comment"]="\n".join(body); cur["score"]=s
+            out.append(cur); state=EXPECT_STORE
+        else: body.append(s)
+    if state!=EXPECT_STORE:   # page text ended mid-record
+        cur.setdefault("timestamp",""); cur["comment"]="\n".join(body); cur["score"]=""
+        out.append(cur)
     return out
 
 def read_seen():
+    """(store, timestamp, comment) UTF-8 byte triples of every logged row."""
     seen=set()
-    if Path(COMMENTS_LOG_PATH).exists():
-        with open(COMMENTS_LOG_PATH, newline="", encoding="utf-8") as f:
-            for r in csv.DictReader(f, fieldnames=["store","timestamp","comment","score"]):
-                seen.add((r["store"],r["timestamp"],r["comment"]))
+    if not Path(COMMENTS_LOG_PATH).exists() or not Path(COMMENTS_LOG_PATH).stat().st_size:
+        return seen
+    with open(COMMENTS_LOG_PATH,"rb") as f, mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) as mm:
+        rec=b""
+        for line in iter(mm.readline,b""):
+            rec+=line
+            if rec.count(b'"')%2: continue          # still inside a quoted multi-line comment
+            rec=rec.rstrip(b"\r\n")
+            if b'"' in rec: row=[v.encode() for v in next(csv.reader([rec.decode()]))]
+            else:           row=rec.split(b",",3)
+            if len(row)>=3: seen.add(tuple(row[:3]))
+            rec=b""
     return seen
 
-def append_comments(new):
-    with open(COMMENTS_LOG_PATH,"a",newline="",encoding="utf-8") as f:
-        w=csv.writer(f); [w.writerow([c["store"],c["timestamp"],c["comment"],c["score"]]) for c in new]
-
-def post_chat(c):
-    try: score=int(c["score"] or 0)
-    except ValueError: score=0
-    emo, lab = ("🔴","Detractor") if score<=4 else ("🟠","Passive") if score<=7 else ("🟢","Promoter")
-    payload={"cards":[{"header":{"title":"New NPS Comment","subtitle":f"{emo} {c['store']} ({lab})"},"sections":[{"widgets":[
-        {"keyValue":{"topLabel":"Timestamp","content":c["timestamp"]}},
-        {"keyValue":{"topLabel":"Score","content":str(score)}},
-        {"textParagraph":{"text":c["comment"].replace('\n','<br>')}}
-    ]}]}]}
-    try:
-        requests.post(MAIN_WEBHOOK,json=payload,timeout=15).raise_for_status()
-        logger.info(f"Posted comment {c['timestamp']}")
-    except Exception as e:
-        logger.error(f"Post failed: {e}")
+def row_key(store, ts, comment):
+    """64-bit identity of a logged row; fields are UTF-8 bytes."""
+    h=hashlib.blake2b(b"\x1f".join((store,ts,comment)), digest_size=8)
+    return int.from_bytes(h.digest(), "little")
+
+def comment_key(c):
+    return row_key(c["store"].encode(), c["timestamp"].encode(), c["comment"].encode())
+
+def log_size():
+    return Path(COMMENTS_LOG_PATH).stat().st_size if Path(COMMENTS_LOG_PATH).exists() else 0
+
+def write_seen_index(keys):
+    out=array("Q",keys)
+    if sys.byteorder=="big": out.byteswap()
+    tmp=Path(SEEN_INDEX_PATH+".tmp")
+    tmp.write_bytes(SEEN_INDEX_MAGIC+log_size().to_bytes(8,"little")+out.tobytes())
+    os.replace(tmp,SEEN_INDEX_PATH)
+
+def read_seen_index():
+    """Sorted array('Q') of logged comment keys; probe it with is_seen()."""
+    data=Path(SEEN_INDEX_PATH).read_bytes() if Path(SEEN_INDEX_PATH).exists() else b""
+    if data[:8]!=SEEN_INDEX_MAGIC or int.from_bytes(data[8:16],"little")!=log_size():
+        # missing, old format, or out of step with the CSV (edited, or a crash
+        # between the CSV append and the index write) ⇒ rebuild from the CSV
+        keys=array("Q",sorted({row_key(*row) for row in read_seen()}))
+        write_seen_index(keys)
+        logger.info(f"Built {SEEN_INDEX_PATH} with {len(keys)} keys")
+        return keys
+    keys=array("Q"); keys.frombytes(memoryview(data)[16:])
+    if sys.byteorder=="big": keys.byteswap()
+    return keys
+
+def is_seen(keys, k):
+    i=bisect_left(keys,k)
+    return i<len(keys) and keys[i]==k
+
+def csv_field(v):
+    return '"'+v.replace('"','""')+'"' if ('"' in v or "," in v or "\n" in v or "\r" in v) else v
+
+def encode_row(c):
+    """One log row exactly as csv.writer writes it (QUOTE_MINIMAL, CRLF), UTF-8 encoded."""
+    return (",".join(map(csv_field,(c["store"],c["timestamp"],c["comment"],c["score"])))+"\r\n").encode()
+
+@contextmanager
+def writer_lock():
+    """Exclusive lock on the comment log for the `with` block; yields False if another
+    process holds it. Closing the file on exit releases the flock."""
+    with open(WRITER_LOCK_PATH,"w") as f:
+        try: fcntl.flock(f, fcntl.LOCK_EX|fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False; return
+        yield True
+
+def append_comments(new, keys=None):
+    """Log `new` and add their keys to the index; `keys` (if given) is updated in place."""
+    if keys is None: keys=read_seen_index()   # before the CSV grows, so a first-time build doesn't include `new`
+    with open(COMMENTS_LOG_PATH,"ab",buffering=1<<16) as f:
+        f.write(b"".join(map(encode_row,new)))
+        f.flush(); os.fsync(f.fileno())   # rows must be durable before their keys are indexed
+    for k in map(comment_key,new):
+        if not is_seen(keys,k): insort(keys,k)
+    write_seen_index(keys)
+
+# Chat card with the four per-comment slots left open; string slots take
+# orjson-encoded (quoted, escaped) values
+CARD_TEMPLATE = (b'{"cards":[{"header":{"title":"New NPS Comment","subtitle":%s},"sections":[{"widgets":['
+                 b'{"keyValue":{"topLabel":"Timestamp","content":%s}},'
+                 b'{"keyValue":{"topLabel":"Score","content":"%d"}},'
+                 b'{"textParagraph":{"text":%s}}]}]}]}')
+
+# NPS band per score 0–10: detractor 0–4, passive 5–7, promoter 8–10
+SCORE_LABELS = (("🔴","Detractor"),)*5 + (("🟠","Passive"),)*3 + (("🟢","Promoter"),)*3
+
+def chat_card(c):
+    """Google Chat card for one comment, as JSON bytes."""
+    score=int(c["score"]) if c["score"].isdecimal() else 0
+    emo, lab = SCORE_LABELS[min(score,10)]   # clamp is load-bearing: score_tokens lets 11–99 through
+    return CARD_TEMPLATE % (orjson.dumps(f"{emo} {c['store']} ({lab})"), orjson.dumps(c["timestamp"]),
+                            score, orjson.dumps(c["comment"].replace('\n','<br>')))
+
+def retry_delay(r, attempt):
+    """Seconds to wait after failed try `attempt` (0-based): Retry-After (delta or
+    HTTP-date) if the server sent one, else jittered exponential backoff."""
+    ra=r.headers.get("Retry-After","").strip()
+    if ra.isdecimal(): return float(ra)
+    try: return max(0.0, (parsedate_to_datetime(ra)-datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+    except (TypeError, ValueError): pass
+    return RETRY_BACKOFF*2**attempt + random.uniform(0, 0.5)
+
+def post_chat(c, body):
+    """One card, up to POST_ATTEMPTS tries; every try is rate-limited and reported to
+    CHAT_GATE so the AIMD cap reacts to the first 429/5xx, not the last."""
+    for attempt in range(POST_ATTEMPTS):
+        if not CHAT_GATE.acquire():
+            logger.info(f"Circuit open ⇒ {c['timestamp']} left for next run")
+            return False
+        ok=False
+        try:
+            CHAT_LIMIT.acquire()
+            r=SESSION.post(CFG.MAIN_WEBHOOK,data=body,timeout=HTTP_TIMEOUT)
+            ok=True if r.ok else False if r.status_code==429 or r.status_code>=500 else None
+        except Exception as e:
+            logger.error(f"Post failed for {c['timestamp']}: {type(e).__name__}")   # str(e) embeds the URL
+            return False
+        finally:
+            CHAT_GATE.release(ok)
+        if r.ok:
+            logger.info(f"Posted comment {c['timestamp']}")
+            return True
+        if r.status_code not in RETRY_STATUS or attempt==POST_ATTEMPTS-1: break
+        delay=retry_delay(r, attempt)   # slept with no gate slot held
+        logger.warning(f"HTTP {r.status_code} for {c['timestamp']} ⇒ retry in {delay:.1f}s")
+        time.sleep(delay)
+    logger.error(f"Post failed for {c['timestamp']}: HTTP {r.status_code} after {attempt+1} tries")
+    return False
+
+def payload_digest(body):
+    return hashlib.blake2b(body, digest_size=8).digest()
+
+def load_payload_cache():
+    """LRU of posted-card digests, most recent last."""
+    cache=OrderedDict()
+    if Path(PAYLOAD_CACHE_PATH).exists():
+        data=Path(PAYLOAD_CACHE_PATH).read_bytes()
+        for i in range(0,len(data)-7,8):
+            h=data[i:i+8]; cache[h]=None; cache.move_to_end(h)
+    return cache
+
+def post_new(new):
+    """Post each distinct card once. Returns the comments now on Chat – posted here or
+    in a recent run – so failed ones stay unlogged and are retried next run."""
+    cache=load_payload_cache(); batch={}; done=set()
+    for c in new:
+        body=chat_card(c); h=payload_digest(body)
+        if h in cache:   logger.info(f"Card for {c['timestamp']} already posted ⇒ skipped"); done.add(id(c))
+        elif h in batch: logger.info(f"Duplicate card for {c['timestamp']} ⇒ not re-posted"); batch[h][1].append(c)
+        else:            batch[h]=(body,[c])
+
+    lock=threading.Lock()
+    def send(item):
+        h,(body,cs)=item
+        if not post_chat(cs[0],body): return []
+        # recorded per post so a crash mid-run cannot lead to a double post
+        with lock, open(PAYLOAD_CACHE_PATH,"ab") as f: f.write(h)
+        return cs
+    with ThreadPoolExecutor(max_workers=POST_WORKERS) as ex:
+        for cs in ex.map(send, batch.items()): done.update(map(id,cs))
+
+    Path(PAYLOAD_CACHE_PATH).write_bytes(b"".join(list(load_payload_cache())[-PAYLOAD_CACHE_SIZE:]))
+    if len(done)<len(new): logger.warning(f"{len(new)-len(done)} comments not delivered – will retry next run")
+    return [c for c in new if id(c) in done]
 
 # ─────────────────────────────── MAIN FLOW ──
-def scrape_once():
-    with sync_playwright() as p:
+def scrape_lines(ctx):
+    """Report lines from `ctx`, logging in (once more if rejected) as needed; None if auth failed."""
+    for attempt in range(2):
         # ensure auth
         if not Path(AUTH_STATE_PATH).exists():
             logger.warning("auth_state.json missing ⇒ auto-login")
-            ctx=p.chromium.launch(headless=True).new_context()
-            ok=auto_login_and_save(ctx); ctx.close()
-            if not ok:
+            ctx.clear_cookies()
+            if not auto_login_and_save(ctx):
                 send_alert("Auto-login failed – manual action required")
-                return
+                return None
 
         # headless scrape
-        ctx=p.chromium.launch(headless=True).new_context(storage_state=AUTH_STATE_PATH)
-        lines=fetch_page_lines(ctx); ctx.close()
-
-    if lines is None:
+        lines=fetch_page_lines(ctx)
+        if lines is not None:
+            ctx.storage_state(path=AUTH_STATE_PATH)   # keep rotated session cookies
+            return lines
         logger.warning("Auth rejected ⇒ one re-login cycle")
         Path(AUTH_STATE_PATH).unlink(missing_ok=True)
-        scrape_once(); return
+    send_alert("Auth rejected after re-login – manual action required")
+    return None
+
+def process_report(lines, seen=None):
+    """Post and log the new comments in `lines`; pass `seen` to reuse an in-memory index."""
     if not lines:
         logger.info("No text lines found"); return
 
-    new=[c for c in parse_comments(lines) if (c["store"],c["timestamp"],c["comment"]) not in read_seen()]
+    if seen is None: seen=read_seen_index()
+    new=[c for c in parse_comments(lines) if not is_seen(seen,comment_key(c))]
     if not new: logger.info("No new comments"); return
 
     logger.info(f"{len(new)} new comments → sending …")
-    for c in new: post_chat(c); time.sleep(1)
-    append_comments(new)
+    sent=post_new(new)
+    if sent: append_comments(sent, seen)
     logger.info("Done")
 
+def scrape_once():
+    with writer_lock() as locked:
+        if not locked:
+            logger.warning("Another scraper holds the comment log – skipping this run"); return
+        with sync_playwright() as p:
+            ctx, close = open_context(p)
+            try:
+                lines=scrape_lines(ctx)
+            finally:
+                close()
+        if lines is not None: process_report(lines)
+
+def reopen_context(p, close):
+    """Close what is left of a dead context and open a fresh one; (None, None) if the
+    relaunch fails too (e.g. the dead Chromium still holds the profile lock)."""
+    try:
+        if close: close()
+    except Exception: pass
+    try: return open_context(p)
+    except Exception as e:
+        logger.error(f"Browser relaunch failed: {e} – retrying next cycle")
+        return None, None
+
+def run_daemon(interval=DAEMON_INTERVAL):
+    """Scrape every `interval` s, keeping one logged-in context (and its browser) warm."""
+    # the in-memory index is only valid while nobody else appends to the log
+    with writer_lock() as locked:
+        if not locked:
+            logger.critical("Another scraper holds the comment log – not starting"); return
+        seen=read_seen_index()
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        with sync_playwright() as p:
+            ctx, close = open_context(p)
+            try:
+                while True:
+                    started=time.monotonic()
+                    if ctx is None: ctx, close = reopen_context(p, close)
+                    if ctx is not None:
+                        try:
+                            lines=scrape_lines(ctx)
+                            if lines is not None: process_report(lines, seen)
+                        except Exception as e:
+                            logger.error(f"Cycle failed: {e}", exc_info=True)
+                            try: ctx.cookies()
+                            except Exception:
+                                logger.warning("Browser gone ⇒ relaunching")
+                                ctx, close = reopen_context(p, close)
+                    time.sleep(max(0, interval-(time.monotonic()-started)))
+            except (KeyboardInterrupt, SystemExit):
+                logger.info("Daemon stopping")
+            finally:
+                if close: close()
+
 # ───────────────────────────── CLI ──
+#   scrape.py                one scrape (cron / CI)
+#   scrape.py login          forget auth_state.json, then one scrape
+#   scrape.py daemon [secs]  scrape forever with a warm browser
 if __name__ == "__main__":
     if len(sys.argv)>1 and sys.argv[1]=="login":
         Path(AUTH_STATE_PATH).unlink(missing_ok=True)
-    scrape_once()
+    if len(sys.argv)>1 and sys.argv[1]=="daemon":
+        run_daemon(int(sys.argv[2]) if len(sys.argv)>2 else DAEMON_INTERVAL)
+    else:
+        scrape_once()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# scrape_server.py – keeps one headless Chromium warm between scrape.py runs.
+#                    scrape.py attaches over CDP while this is running and
+#                    falls back to launching its own browser otherwise.
+#
+#   python scrape_server.py      (run from the repo dir, under systemd / tmux next to the cron job)
+
+import sys, time, signal, logging, tempfile
+from pathlib import Path
+from playwright.sync_api import sync_playwright
+
+# ─────────────────────────────────────────── CONFIG ──
+# read by scrape.py; kept in the repo dir, not /tmp, so other local users can't plant one
+BROWSER_WS_PATH = Path("browser_endpoint")
+# port 0: Chromium binds a free port itself, so nothing can squat a fixed port first
+CDP_ARGS        = ["--remote-debugging-port=0", "--remote-debugging-address=127.0.0.1"]
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s | %(levelname)-8s | %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)],
+)
+logger = logging.getLogger("scrape_server")
+
+# ─────────────────────────────────────────── SERVE ──
+def devtools_port(profile, timeout=10.0):
+    """Port Chromium picked for --remote-debugging-port=0 (first line of DevToolsActivePort)."""
+    f=Path(profile, "DevToolsActivePort"); deadline=time.monotonic()+timeout
+    while not (f.exists() and f.read_text().strip()):
+        if time.monotonic()>deadline: raise TimeoutError("Chromium did not report its DevTools port")
+        time.sleep(0.1)
+    return int(f.read_text().split()[0])
+
+def serve():
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    # private (0700) profile dir – DevToolsActivePort is only readable by us
+    with tempfile.TemporaryDirectory(prefix="nps-chromium-") as profile, sync_playwright() as p:
+        ctx=p.chromium.launch_persistent_context(profile, headless=True, args=CDP_ARGS)
+        closed=[]; ctx.on("close", lambda *_: closed.append(True))
+        try:
+            endpoint=f"http://127.0.0.1:{devtools_port(profile)}"
+            BROWSER_WS_PATH.write_text(endpoint); BROWSER_WS_PATH.chmod(0o600)
+            logger.info(f"Chromium up → {endpoint} (advertised in {BROWSER_WS_PATH})")
+            # an idle page keeps Playwright's event loop pumping so a crashed
+            # Chromium surfaces here instead of leaving a stale endpoint behind
+            idle=ctx.pages[0] if ctx.pages else ctx.new_page()
+            while not closed: idle.wait_for_timeout(5_000)
+            logger.warning("Chromium exited")
+        except (KeyboardInterrupt, SystemExit):
+            logger.info("Shutting down")
+        except Exception as e:
+            logger.error(f"Chromium lost: {e}")
+        finally:
+            BROWSER_WS_PATH.unlink(missing_ok=True)
+            ctx.close()
+
+if __name__ == "__main__":
+    serve()